@@ -0,0 +1,601 @@
+"""
+Bitcoin Transaction Tracer - Shared Tracing Code
+Traces the lineage of Bitcoin transactions to understand blockchain transparency.
+
+Imported by the api/trace.py and api/trace_stream.py functions; the
+leading underscore keeps Vercel from deploying it as an endpoint.
+"""
+
+import functools
+import os
+import tempfile
+import cachetools
+import msgspec
+import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import time
+from datetime import datetime, timedelta, timezone
+
+
+def _short_address(address: str) -> str:
+    """Display label for an address node, e.g. '1A1zP1eP...Lmv7DivfNa'."""
+    return f"{address[:8]}...{address[-8:]}"
+
+
+
+class Prevout(msgspec.Struct):
+    """The output an input spends: who held the coins and how many."""
+    scriptpubkey_address: Optional[str] = None
+    value: Optional[int] = None
+
+
+class TxInput(msgspec.Struct):
+    txid: Optional[str] = None
+    prevout: Optional[Prevout] = None
+    is_coinbase: bool = False
+
+
+class TxOutput(msgspec.Struct):
+    scriptpubkey_address: Optional[str] = None
+    value: Optional[int] = None
+
+
+class TxStatus(msgspec.Struct):
+    confirmed: bool = False
+    block_hash: Optional[str] = None
+    block_time: Optional[int] = None
+
+
+class Transaction(msgspec.Struct):
+    """
+    The fields of a Blockstream transaction the tracer uses.
+    
+    Decoding into this type skips scripts, witnesses and other unused
+    fields while parsing, so they never become Python objects.
+    """
+    txid: str
+    vin: List[TxInput] = []
+    vout: List[TxOutput] = []
+    size: Optional[int] = None
+    fee: Optional[int] = None
+    status: TxStatus = msgspec.field(default_factory=TxStatus)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    
+    Allows short bursts up to `capacity` requests, then holds callers
+    to an average of `rate` requests per second.
+    """
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Take one token, sleeping until it is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            
+            # Reserve the token now so concurrent callers queue up behind us
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that takes a rate limiter token before each request.
+    
+    Adapters only see requests that actually go to the network, so
+    responses served from cache never wait.
+    """
+    
+    def __init__(self, rate_limiter: TokenBucket, **kwargs):
+        self.rate_limiter = rate_limiter
+        super().__init__(**kwargs)
+    
+    def send(self, request, **kwargs):
+        self.rate_limiter.acquire()
+        return super().send(request, **kwargs)
+
+
+# Connections kept per session. More workers than this gain nothing: the
+# token bucket caps the API at 5 req/s long before the pool runs dry.
+SESSION_POOL_SIZE = 32
+
+
+@functools.lru_cache(maxsize=None)
+def get_shared_session(base_url: str) -> requests_cache.CachedSession:
+    """
+    Build the HTTP session for an API, once per process.
+    
+    Cached at module scope so every TransactionTracer on a warm serverless
+    instance shares keep-alive connections, cached responses and one
+    rate limit budget.
+    """
+    # Persistent HTTP cache so warm and later invocations skip repeat lookups.
+    # Confirmed transactions never change; address histories grow with new blocks.
+    api_host = base_url.split('://', 1)[1]
+    session = requests_cache.CachedSession(
+        cache_name=os.environ.get(
+            'TRACE_CACHE_PATH',
+            os.path.join(tempfile.gettempdir(), 'blockstream_cache')
+        ),
+        backend='sqlite',
+        expire_after=60,
+        urls_expire_after={
+            f"{api_host}/tx/*": requests_cache.NEVER_EXPIRE,
+            f"{api_host}/address/*": 30,
+        },
+        allowable_codes=(200,)
+    )
+    session.headers.update({'User-Agent': 'Bitcoin-Transaction-Explorer-Educational'})
+    
+    # Keep enough pooled connections for every worker thread, and retry
+    # transient API errors (rate limiting, gateway hiccups) with backoff.
+    # Blockstream allows roughly 5 req/s in short bursts - be nice to free API
+    adapter = RateLimitedAdapter(
+        TokenBucket(rate=5, capacity=5),
+        pool_connections=1,
+        pool_maxsize=SESSION_POOL_SIZE,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=["GET"]
+        )
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    
+    return session
+
+
+class TransactionTracer:
+    """
+    Traces Bitcoin transactions backward through the blockchain.
+    Uses Blockstream.info API (free, no authentication required).
+    """
+    
+    def __init__(self, max_depth: int = 5, max_addresses: int = 50, max_workers: int = 8,
+                 max_inputs: int = 5, stop_on_first_coinbase: bool = False):
+        """
+        Initialize the tracer with limits to prevent excessive API calls.
+        
+        Args:
+            max_depth: How many transaction hops to trace back (default 5)
+            max_addresses: Maximum addresses to analyze (prevents runaway queries)
+            max_workers: Maximum requests in flight at once (default 8,
+                capped at SESSION_POOL_SIZE)
+            max_inputs: Inputs traced per transaction, largest first (default 5)
+            stop_on_first_coinbase: Stop tracing as soon as a coinbase is found
+        """
+        self.base_url = "https://blockstream.info/api"
+        self.max_depth = max_depth
+        self.max_addresses = max_addresses
+        self.max_workers = min(max_workers, SESSION_POOL_SIZE)
+        self.max_inputs = max_inputs
+        self.stop_on_first_coinbase = stop_on_first_coinbase
+        
+        # One session per API and process: warm invocations reuse its
+        # connection pool, persistent response cache and rate limiter
+        self.session = get_shared_session(self.base_url)
+        
+        # Cache to avoid re-fetching same data (shared by worker threads and,
+        # on a warm instance, by later invocations). Bounded so memory stays
+        # flat as the instance ages; address histories expire like the HTTP cache.
+        # Only confirmed transactions go in tx_cache - unconfirmed ones can
+        # still change and are left to the HTTP cache's 60 s expiry.
+        self.tx_cache: Dict[str, Transaction] = cachetools.LRUCache(maxsize=10_000)
+        self.address_cache: Dict[str, List[Transaction]] = cachetools.TTLCache(maxsize=1_000, ttl=30)
+        self._cache_lock = threading.Lock()
+    
+    def get_address_transactions(self, address: str) -> Optional[List[Transaction]]:
+        """
+        Fetch the incoming transactions for a given Bitcoin address.
+        
+        Args:
+            address: Bitcoin address (legacy, segwit, or bech32)
+            
+        Returns:
+            List of transaction objects with at least one output paying
+            the address (where it received coins), or None if the history
+            can't be fetched
+        """
+        # A single get(): a TTL entry can expire between 'in' and '[]'
+        with self._cache_lock:
+            cached = self.address_cache.get(address)
+        if cached is not None:
+            return cached
+        
+        try:
+            url = f"{self.base_url}/address/{address}/txs"
+            response = self.session.get(url, timeout=10)
+            response.raise_for_status()
+            
+            txs = msgspec.json.decode(response.content, type=List[Transaction])
+            with self._cache_lock:
+                # Keep the full confirmed transactions warm for later lookups
+                for tx in txs:
+                    if tx.status.confirmed:
+                        self.tx_cache.setdefault(tx.txid, tx)
+            
+            # Outgoing spends don't show where this address's coins came from
+            txs = [
+                tx for tx in txs
+                if any(out.scriptpubkey_address == address for out in tx.vout)
+            ]
+            with self._cache_lock:
+                self.address_cache[address] = txs
+            return txs
+            
+        except (requests.exceptions.RequestException, msgspec.DecodeError) as e:
+            print(f"Error fetching address {address}: {e}")
+            return None
+    
+    def get_transaction(self, txid: str) -> Optional[Transaction]:
+        """
+        Fetch detailed transaction information.
+        
+        trace_lineage gets its transactions from address histories, so this
+        is only hit for a single txid at a time (loading more inputs) and
+        usually answered from tx_cache or the HTTP cache.
+        
+        Args:
+            txid: Transaction ID (hash)
+            
+        Returns:
+            Transaction with inputs and outputs, or None if it can't be fetched
+        """
+        with self._cache_lock:
+            cached = self.tx_cache.get(txid)
+        if cached is not None:
+            return cached
+        
+        try:
+            url = f"{self.base_url}/tx/{txid}"
+            response = self.session.get(url, timeout=10)
+            response.raise_for_status()
+            
+            tx = msgspec.json.decode(response.content, type=Transaction)
+            if tx.status.confirmed:
+                with self._cache_lock:
+                    self.tx_cache[txid] = tx
+            
+            # Unconfirmed transactions can still change - only cache them briefly
+            elif not getattr(response, 'from_cache', False):
+                self.session.cache.save_response(
+                    response,
+                    expires=datetime.now(timezone.utc) + timedelta(seconds=60)
+                )
+            
+            return tx
+            
+        except (requests.exceptions.RequestException, msgspec.DecodeError) as e:
+            print(f"Error fetching transaction {txid}: {e}")
+            return None
+    
+    def sorted_inputs(self, tx: Transaction) -> List[TxInput]:
+        """
+        Return a transaction's inputs ordered by value, largest first.
+        
+        Consolidation and mixer transactions can have thousands of inputs,
+        so only the most valuable ones are traced up front.
+        """
+        return sorted(
+            tx.vin,
+            key=lambda inp: -((inp.prevout and inp.prevout.value) or 0)
+        )
+    
+    def get_transaction_inputs(self, txid: str, offset: int = 0, limit: int = 25,
+                               depth: Optional[int] = None) -> Optional[Dict]:
+        """
+        Load a page of a transaction's inputs beyond those traced by default.
+        
+        Args:
+            txid: Transaction ID (hash)
+            offset: Number of inputs to skip, in the same largest-first order
+                used by trace_lineage
+            limit: Maximum number of inputs to return
+            depth: Depth of the transaction node in the trace; address nodes
+                are placed one level deeper (omitted if not given)
+            
+        Returns:
+            Dictionary containing the page's address nodes and input edges,
+            plus whether more inputs remain, or None if the transaction
+            can't be fetched
+        """
+        tx = self.get_transaction(txid)
+        if tx is None:
+            return None
+        vin = self.sorted_inputs(tx)
+        
+        nodes = []
+        edges = []
+        for inp in vin[offset:offset + limit]:
+            if not inp.prevout or not inp.prevout.scriptpubkey_address:
+                continue
+            prev_address = inp.prevout.scriptpubkey_address
+            
+            node = {
+                'id': prev_address,
+                'type': 'address',
+                'label': _short_address(prev_address)
+            }
+            if depth is not None:
+                node['depth'] = depth + 1
+            nodes.append(node)
+            edges.append({
+                'source': prev_address,
+                'target': txid,
+                'type': 'input',
+                'amount': inp.prevout.value
+            })
+        
+        return {
+            'nodes': nodes,
+            'edges': edges,
+            'txid': txid,
+            'input_count': len(vin),
+            'offset': offset,
+            'has_more_inputs': offset + limit < len(vin)
+        }
+    
+    def is_coinbase(self, tx: Optional[Transaction]) -> bool:
+        """
+        Check if transaction is a coinbase (mining reward) transaction.
+        
+        Coinbase transactions have no inputs (they create new bitcoins).
+        These are the "purest" coins - directly from mining.
+        """
+        if not tx or not tx.vin:
+            return False
+        
+        # Blockstream flags the coinbase input directly; fall back to the
+        # missing previous output for backends without the flag
+        first_input = tx.vin[0]
+        return first_input.is_coinbase or first_input.txid is None
+    
+    def iter_lineage(self, address: str, max_depth: Optional[int] = None,
+                     stop_on_first_coinbase: Optional[bool] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Trace the lineage of coins received by an address, yielding the
+        graph as it is discovered.
+        
+        Uses breadth-first search to explore transaction history,
+        going backwards from the address through its inputs. Each depth
+        level is expanded as a batch so its addresses can be fetched
+        concurrently.
+        
+        Args:
+            address: Starting Bitcoin address
+            max_depth: Overrides the tracer's max_depth for this trace
+            stop_on_first_coinbase: Overrides the tracer's setting for this trace
+            
+        Yields:
+            ('node', {id, type, label, depth, ...}) and
+            ('edge', {source, target, type, ...}) as they are found,
+            then a final ('stats', {...}) with statistics and findings
+        """
+        if max_depth is None:
+            max_depth = self.max_depth
+        if stop_on_first_coinbase is None:
+            stop_on_first_coinbase = self.stop_on_first_coinbase
+        
+        # Exact sets on purpose: a probabilistic filter's false positives would
+        # silently drop branches, and these hold at most a few thousand ids
+        visited_txs: Set[str] = set()
+        visited_addresses: Set[str] = set()
+        
+        # BFS frontier: addresses to expand at the current depth
+        current_frontier = [address]
+        visited_addresses.add(address)
+        
+        # Addresses left to discover; checked before enqueuing so the frontier
+        # only ever holds addresses that will actually be expanded
+        remaining_budget = self.max_addresses - 1
+        
+        # Statistics tracking
+        stats = {
+            'total_addresses': 0,
+            'total_transactions': 0,
+            'max_depth_reached': 0,
+            'coinbase_found': False,
+            'coinbase_distance': None,
+            'fetch_errors': 0
+        }
+        
+        # Add starting node
+        yield 'node', {
+            'id': address,
+            'type': 'address',
+            'label': _short_address(address),
+            'depth': 0,
+            'is_target': True
+        }
+        
+        depth = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Level-synchronous BFS: the whole frontier at one depth is expanded
+            # as a batch before moving on, so its requests run concurrently
+            while current_frontier:
+                stats['max_depth_reached'] = depth
+                next_frontier: List[Tuple[int, str]] = []  # (amount received, address)
+                
+                # 1. Get the transaction history of every frontier address concurrently.
+                #    These are full transactions (inputs include prevouts), so no
+                #    per-transaction lookup is needed.
+                histories = executor.map(self.get_address_transactions, current_frontier)
+                
+                # 2. Collect the level's incoming transactions (where each address
+                #    received coins), skipping any seen on an earlier path
+                level_txs = []  # (receiving address, transaction)
+                for current_id, txs in zip(current_frontier, histories):
+                    if txs is None:
+                        # The trace is incomplete; callers must not treat it as settled
+                        stats['fetch_errors'] += 1
+                        continue
+                    
+                    for tx_details in txs:
+                        if tx_details.txid in visited_txs:
+                            continue
+                        
+                        visited_txs.add(tx_details.txid)
+                        level_txs.append((current_id, tx_details))
+                
+                # 3. Build nodes/edges and gather the next frontier from their inputs
+                for current_id, tx_details in level_txs:
+                    txid = tx_details.txid
+                    stats['total_transactions'] += 1
+                    
+                    # Check if coinbase
+                    is_coinbase = self.is_coinbase(tx_details)
+                    if is_coinbase:
+                        stats['coinbase_found'] = True
+                        if stats['coinbase_distance'] is None:
+                            stats['coinbase_distance'] = depth
+                    
+                    # Trace the largest inputs (where coins came FROM). Inputs past
+                    # max_depth would never be expanded, so don't enqueue them.
+                    # Their records are held back so the transaction node, which
+                    # says how many inputs were traced, is yielded first
+                    input_records: List[Tuple[str, Dict]] = []
+                    inputs_traced = 0
+                    if not is_coinbase and depth < max_depth:
+                        for inp in self.sorted_inputs(tx_details)[:self.max_inputs]:
+                            if inp.prevout and inp.prevout.scriptpubkey_address:
+                                prev_address = inp.prevout.scriptpubkey_address
+                                
+                                if prev_address not in visited_addresses:
+                                    if remaining_budget <= 0:
+                                        break
+                                    
+                                    remaining_budget -= 1
+                                    visited_addresses.add(prev_address)
+                                    stats['total_addresses'] += 1
+                                    
+                                    # Add previous address node
+                                    input_records.append(('node', {
+                                        'id': prev_address,
+                                        'type': 'address',
+                                        'label': _short_address(prev_address),
+                                        'depth': depth + 1
+                                    }))
+                                    
+                                    # Add edge from address to transaction
+                                    input_records.append(('edge', {
+                                        'source': prev_address,
+                                        'target': txid,
+                                        'type': 'input',
+                                        'amount': inp.prevout.value
+                                    }))
+                                    
+                                    # Explore on the next level
+                                    next_frontier.append((inp.prevout.value or 0, prev_address))
+                            
+                            inputs_traced += 1
+                    
+                    # Add transaction node. Loading more inputs resumes at
+                    # offset=inputs_traced (largest first)
+                    input_count = len(tx_details.vin)
+                    yield 'node', {
+                        'id': txid,
+                        'type': 'transaction',
+                        'label': f"TX: {txid[:8]}...",
+                        'depth': depth,
+                        'is_coinbase': is_coinbase,
+                        'timestamp': tx_details.status.block_time,
+                        'size': tx_details.size,
+                        'fee': tx_details.fee,
+                        'input_count': input_count,
+                        'inputs_traced': inputs_traced,
+                        'is_truncated': not is_coinbase and inputs_traced < input_count
+                    }
+                    
+                    # Add edge from transaction to address
+                    yield 'edge', {
+                        'source': txid,
+                        'target': current_id,
+                        'type': 'output'
+                    }
+                    
+                    yield from input_records
+                    
+                    # Answering "how far from newly mined coins?" only needs the first coinbase
+                    if is_coinbase and stop_on_first_coinbase:
+                        next_frontier = []
+                        break
+                
+                # Best-first within a level: larger flows are likelier to reach
+                # a coinbase quickly, so expand them (and their transactions) first
+                next_frontier.sort(key=lambda entry: -entry[0])
+                current_frontier = [prev_address for _, prev_address in next_frontier]
+                depth += 1
+        
+        yield 'stats', stats
+    
+    def trace_lineage(self, address: str, max_depth: Optional[int] = None,
+                      stop_on_first_coinbase: Optional[bool] = None) -> Dict:
+        """
+        Trace the lineage of coins received by an address.
+        
+        Collects everything yielded by iter_lineage into one graph.
+        
+        Args:
+            address: Starting Bitcoin address
+            max_depth: Overrides the tracer's max_depth for this trace
+            stop_on_first_coinbase: Overrides the tracer's setting for this trace
+            
+        Returns:
+            Dictionary containing:
+            - nodes: List of addresses/transactions in the graph
+            - edges: Connections between them
+            - metadata: Statistics and findings
+        """
+        # Data structures for the graph. These stay as plain dicts in the
+        # response shape: the graph is bounded by max_addresses (each with one
+        # 25-transaction history page) and max_inputs edges per transaction,
+        # so a columnar layout would not pay for the conversion back to JSON.
+        nodes = []  # List of {id, type, label, depth, ...}
+        edges = []  # List of {source, target, amount, ...}
+        stats = {}
+        
+        for kind, item in self.iter_lineage(address, max_depth, stop_on_first_coinbase):
+            if kind == 'node':
+                nodes.append(item)
+            elif kind == 'edge':
+                edges.append(item)
+            else:
+                stats = item
+        
+        return {
+            'nodes': nodes,
+            'edges': edges,
+            'stats': stats,
+            'target_address': address
+        }
+
+
+# Shared by every invocation on a warm instance, so its caches carry over.
+# Depth and coinbase stopping are passed per call rather than mutated here.
+shared_tracer = TransactionTracer(max_depth=10)
+
+EDUCATIONAL_NOTE = (
+    "This shows the transaction history of the address. "
+    "Each connection represents where coins came from. "
+    "Bitcoin's public ledger makes all of this traceable."
+)
@@ -6,244 +6,41 @@ This is an EDUCATIONAL tool to demonstrate how Bitcoin's public ledger works.
 Not for compliance, financial advice, or determining transaction legitimacy.
 """
 
-import json
-import requests
-from typing import Dict, List, Set, Tuple
-from collections import deque
+import gzip
+import hashlib
+import re
+import orjson
+from typing import Dict, Optional
 from http.server import BaseHTTPRequestHandler
-import time
 
+from api._tracer import EDUCATIONAL_NOTE, TransactionTracer, shared_tracer
 
-class TransactionTracer:
-    """
-    Traces Bitcoin transactions backward through the blockchain.
-    Uses Blockstream.info API (free, no authentication required).
+
+def _accepts_gzip(accept_encoding: str) -> bool:
     """
+    Whether an Accept-Encoding header allows a gzip response.
     
-    def __init__(self, max_depth: int = 5, max_addresses: int = 50):
-        """
-        Initialize the tracer with limits to prevent excessive API calls.
-        
-        Args:
-            max_depth: How many transaction hops to trace back (default 5)
-            max_addresses: Maximum addresses to analyze (prevents runaway queries)
-        """
-        self.base_url = "https://blockstream.info/api"
-        self.max_depth = max_depth
-        self.max_addresses = max_addresses
-        self.session = requests.Session()
-        self.session.headers.update({'User-Agent': 'Bitcoin-Transaction-Explorer-Educational'})
-        
-        # Cache to avoid re-fetching same data
-        self.tx_cache: Dict[str, dict] = {}
-        self.address_cache: Dict[str, list] = {}
-    
-    def get_address_transactions(self, address: str) -> List[dict]:
-        """
-        Fetch all transactions for a given Bitcoin address.
-        
-        Args:
-            address: Bitcoin address (legacy, segwit, or bech32)
-            
-        Returns:
-            List of transaction objects
-        """
-        if address in self.address_cache:
-            return self.address_cache[address]
-        
-        try:
-            url = f"{self.base_url}/address/{address}/txs"
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            
-            txs = response.json()
-            self.address_cache[address] = txs
-            return txs
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching address {address}: {e}")
-            return []
-    
-    def get_transaction(self, txid: str) -> dict:
-        """
-        Fetch detailed transaction information.
-        
-        Args:
-            txid: Transaction ID (hash)
-            
-        Returns:
-            Transaction object with inputs and outputs
-        """
-        if txid in self.tx_cache:
-            return self.tx_cache[txid]
-        
-        try:
-            url = f"{self.base_url}/tx/{txid}"
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            
-            tx = response.json()
-            self.tx_cache[txid] = tx
-            
-            # Rate limiting - be nice to free API
-            time.sleep(0.2)
-            
-            return tx
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching transaction {txid}: {e}")
-            return {}
-    
-    def is_coinbase(self, tx: dict) -> bool:
-        """
-        Check if transaction is a coinbase (mining reward) transaction.
-        
-        Coinbase transactions have no inputs (they create new bitcoins).
-        These are the "purest" coins - directly from mining.
-        """
-        if not tx or 'vin' not in tx:
-            return False
-        
-        # Coinbase tx has a single input with no previous output
-        if len(tx['vin']) == 1 and 'txid' not in tx['vin'][0]:
-            return True
-        
-        return False
+    Codings are comma-separated with optional q-values; 'gzip;q=0'
+    refuses gzip, and '*' covers codings not listed by name (RFC 9110).
+    """
+    qvalues = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[name.strip().lower()] = q
     
-    def trace_lineage(self, address: str) -> Dict:
-        """
-        Trace the lineage of coins received by an address.
-        
-        Uses breadth-first search to explore transaction history,
-        going backwards from the address through its inputs.
-        
-        Args:
-            address: Starting Bitcoin address
-            
-        Returns:
-            Dictionary containing:
-            - nodes: List of addresses/transactions in the graph
-            - edges: Connections between them
-            - metadata: Statistics and findings
-        """
-        # Data structures for the graph
-        nodes = []  # List of {id, type, label, depth, ...}
-        edges = []  # List of {source, target, amount, ...}
-        visited_txs: Set[str] = set()
-        visited_addresses: Set[str] = set()
-        
-        # BFS queue: (address/txid, depth, node_type)
-        queue = deque([(address, 0, 'address')])
-        visited_addresses.add(address)
-        
-        # Statistics tracking
-        stats = {
-            'total_addresses': 0,
-            'total_transactions': 0,
-            'max_depth_reached': 0,
-            'coinbase_found': False,
-            'coinbase_distance': None
-        }
-        
-        # Add starting node
-        nodes.append({
-            'id': address,
-            'type': 'address',
-            'label': f"{address[:8]}...{address[-8:]}",
-            'depth': 0,
-            'is_target': True
-        })
-        
-        while queue and len(visited_addresses) < self.max_addresses:
-            current_id, depth, node_type = queue.popleft()
-            
-            if depth > self.max_depth:
-                continue
-            
-            stats['max_depth_reached'] = max(stats['max_depth_reached'], depth)
-            
-            # Process based on node type
-            if node_type == 'address':
-                # Get transactions for this address
-                txs = self.get_address_transactions(current_id)
-                
-                # Look at incoming transactions (where this address received coins)
-                for tx in txs:
-                    txid = tx['txid']
-                    
-                    if txid in visited_txs:
-                        continue
-                    
-                    visited_txs.add(txid)
-                    stats['total_transactions'] += 1
-                    
-                    # Get full transaction details
-                    tx_details = self.get_transaction(txid)
-                    
-                    if not tx_details:
-                        continue
-                    
-                    # Check if coinbase
-                    is_coinbase = self.is_coinbase(tx_details)
-                    if is_coinbase:
-                        stats['coinbase_found'] = True
-                        if stats['coinbase_distance'] is None:
-                            stats['coinbase_distance'] = depth
-                    
-                    # Add transaction node
-                    nodes.append({
-                        'id': txid,
-                        'type': 'transaction',
-                        'label': f"TX: {txid[:8]}...",
-                        'depth': depth,
-                        'is_coinbase': is_coinbase,
-                        'timestamp': tx_details.get('status', {}).get('block_time'),
-                        'size': tx_details.get('size'),
-                        'fee': tx_details.get('fee')
-                    })
-                    
-                    # Add edge from transaction to address
-                    edges.append({
-                        'source': txid,
-                        'target': current_id,
-                        'type': 'output'
-                    })
-                    
-                    # If not coinbase, trace inputs (where coins came FROM)
-                    if not is_coinbase and depth < self.max_depth:
-                        for inp in tx_details.get('vin', []):
-                            if 'prevout' in inp and 'scriptpubkey_address' in inp['prevout']:
-                                prev_address = inp['prevout']['scriptpubkey_address']
-                                
-                                if prev_address not in visited_addresses:
-                                    visited_addresses.add(prev_address)
-                                    stats['total_addresses'] += 1
-                                    
-                                    # Add previous address node
-                                    nodes.append({
-                                        'id': prev_address,
-                                        'type': 'address',
-                                        'label': f"{prev_address[:8]}...{prev_address[-8:]}",
-                                        'depth': depth + 1
-                                    })
-                                    
-                                    # Add edge from address to transaction
-                                    edges.append({
-                                        'source': prev_address,
-                                        'target': txid,
-                                        'type': 'input',
-                                        'amount': inp['prevout'].get('value')
-                                    })
-                                    
-                                    # Add to queue for further exploration
-                                    queue.append((prev_address, depth + 1, 'address'))
-        
-        return {
-            'nodes': nodes,
-            'edges': edges,
-            'stats': stats,
-            'target_address': address
-        }
+    q = qvalues.get('gzip', qvalues.get('x-gzip', qvalues.get('*', 0.0)))
+    return q > 0
+
+
+TXID_PATTERN = re.compile(r'[0-9a-fA-F]{64}')
 
 
 # Vercel serverless function handler
@@ -253,6 +50,13 @@ class handler(BaseHTTPRequestHandler):
     
     Accepts GET requests with 'address' parameter.
     Example: /api/trace?address=1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa&depth=5
+    
+    Remaining inputs of a truncated transaction are loaded with 'txid'.
+    Example: /api/trace?txid=<txid>&offset=<inputs_traced>&tx_depth=2
+    
+    Add '&stop_on_coinbase=1' to stop at the first coinbase ancestor,
+    and '&pretty=1' for indented JSON. To receive the graph while it is
+    traced, use /api/trace_stream (api/trace_stream.py).
     """
     
     def do_GET(self):
@@ -264,16 +68,32 @@ class handler(BaseHTTPRequestHandler):
         
         # Get address from query params
         address = params.get('address', [None])[0]
-        depth = int(params.get('depth', [5])[0])
+        txid = params.get('txid', [None])[0]
+        try:
+            depth = int(params.get('depth', [5])[0])
+            offset = int(params.get('offset', [shared_tracer.max_inputs])[0])
+            tx_depth = params.get('tx_depth', [None])[0]
+            tx_depth = int(tx_depth) if tx_depth is not None else None
+        except ValueError:
+            self.send_error_json(400, {
+                'error': 'depth, offset and tx_depth must be integers'
+            })
+            return
+        stop_on_coinbase = params.get('stop_on_coinbase', ['0'])[0] == '1'
+        
+        # Compact JSON by default; indenting roughly doubles serialization cost
+        json_option = orjson.OPT_INDENT_2 if params.get('pretty', ['0'])[0] == '1' else 0
+        
+        if txid and not address:
+            self.send_inputs_page(txid, offset, tx_depth, json_option)
+            return
         
         if not address:
-            self.send_response(400)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            self.send_error_json(400, {
                 'error': 'Missing required parameter: address',
-                'usage': '/api/trace?address=<bitcoin_address>&depth=<optional_depth>'
-            }).encode())
+                'usage': '/api/trace?address=<bitcoin_address>&depth=<optional_depth>',
+                'inputs_usage': '/api/trace?txid=<txid>&offset=<optional_offset>'
+            })
             return
         
         # Validate depth
@@ -282,32 +102,108 @@ class handler(BaseHTTPRequestHandler):
         
         try:
             # Trace the transaction lineage
-            tracer = TransactionTracer(max_depth=depth)
-            result = tracer.trace_lineage(address)
+            result = shared_tracer.trace_lineage(
+                address, max_depth=depth, stop_on_first_coinbase=stop_on_coinbase
+            )
             
             # Add educational metadata
-            result['educational_note'] = (
-                "This shows the transaction history of the address. "
-                "Each connection represents where coins came from. "
-                "Bitcoin's public ledger makes all of this traceable."
-            )
+            result['educational_note'] = EDUCATIONAL_NOTE
             
-            # Success response
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')  # Allow frontend to call
-            self.end_headers()
-            self.wfile.write(json.dumps(result, indent=2).encode())
+            # Success response. A trace missing an address history (rate limit,
+            # timeout) is incomplete and must not be cached. Traces that reached
+            # a coinbase are settled history; others may still extend as new
+            # blocks arrive, so cache them briefly
+            if result['stats']['fetch_errors']:
+                cache_control = 'no-store'
+            elif result['stats']['coinbase_found']:
+                cache_control = 'public, s-maxage=3600, stale-while-revalidate=86400'
+            else:
+                cache_control = 'public, s-maxage=60, stale-while-revalidate=300'
+            self.send_cached_json(orjson.dumps(result, option=json_option), cache_control)
             
         except Exception as e:
             # Error response
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            self.send_error_json(500, {
                 'error': str(e),
                 'message': 'Failed to trace transaction lineage'
-            }).encode())
+            })
+    
+    def send_inputs_page(self, txid: str, offset: int, tx_depth: Optional[int] = None,
+                         json_option: int = 0):
+        """Serve the next chunk of a truncated transaction's inputs"""
+        if not TXID_PATTERN.fullmatch(txid):
+            self.send_error_json(400, {'error': 'txid must be 64 hexadecimal characters'})
+            return
+        
+        try:
+            result = shared_tracer.get_transaction_inputs(txid, offset=max(offset, 0), depth=tx_depth)
+            if result is None:
+                # Unknown txid or upstream failure - never let the edge cache this
+                self.send_error_json(502, {
+                    'error': f"Could not fetch transaction {txid}",
+                    'message': 'Failed to load transaction inputs'
+                })
+                return
+            
+            self.send_cached_json(
+                orjson.dumps(result, option=json_option),
+                'public, s-maxage=3600, stale-while-revalidate=86400'
+            )
+            
+        except Exception as e:
+            self.send_error_json(500, {
+                'error': str(e),
+                'message': 'Failed to load transaction inputs'
+            })
+    
+    def send_error_json(self, status: int, payload: Dict):
+        """Send an uncacheable JSON error response"""
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(orjson.dumps(payload))
+    
+    def send_cached_json(self, body: bytes, cache_control: str):
+        """
+        Send a 200 JSON response that the CDN and browsers can cache.
+        
+        Identical queries are answered from the edge using the ETag and
+        Cache-Control headers; a matching If-None-Match gets a bodyless 304.
+        The body is gzipped when the client accepts it, so the ETag is weak:
+        it identifies the JSON content, not the encoded bytes.
+        """
+        etag = 'W/"' + hashlib.sha256(body).hexdigest() + '"'
+        
+        # If-None-Match is a comma-separated list compared weakly (RFC 9110)
+        if_none_match = self.headers.get('If-None-Match', '')
+        candidates = [tag.strip() for tag in if_none_match.split(',')]
+        if '*' in candidates or any(
+            tag.replace('W/', '', 1) == etag[2:] for tag in candidates
+        ):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')  # Allow frontend to call
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        
+        if _accepts_gzip(self.headers.get('Accept-Encoding', '')):
+            body = gzip.compress(body, compresslevel=6)
+            self.send_header('Content-Encoding', 'gzip')
+        
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
@@ -318,9 +214,9 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
 
 
-# For local testing
+# For local testing: python -m api.trace (from the project root)
 if __name__ == '__main__':
     # Test with Satoshi's first known address
     tracer = TransactionTracer(max_depth=3)
     result = tracer.trace_lineage('1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa')
-    print(json.dumps(result, indent=2))
+    print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
@@ -0,0 +1,94 @@
+"""
+Bitcoin Transaction Tracer - Streaming Endpoint
+Streams a lineage trace as newline-delimited JSON while it is discovered.
+
+Vercel buffers the whole response of BaseHTTPRequestHandler functions, so
+streaming lives in its own ASGI function instead of api/trace.py.
+"""
+
+from typing import Dict, Iterator
+
+import orjson
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from api._tracer import EDUCATIONAL_NOTE, shared_tracer
+
+
+def iter_records(address: str, depth: int, stop_on_coinbase: bool) -> Iterator[bytes]:
+    """
+    Yield the trace as NDJSON lines.
+    
+    Each line is {"node": ...} or {"edge": ...}. The last line is
+    {"stats": ..., "target_address": ..., "done": true}, or an
+    {"error": ...} record if the trace fails part-way.
+    """
+    records = shared_tracer.iter_lineage(address, depth, stop_on_coinbase)
+    
+    while True:
+        # Only tracer failures become error records; a client disconnect
+        # closes this generator and is handled by the server
+        try:
+            kind, item = next(records)
+        except StopIteration:
+            return
+        except Exception as e:
+            yield orjson.dumps({
+                'error': str(e),
+                'message': 'Failed to trace transaction lineage'
+            }) + b"\n"
+            return
+        
+        if kind == 'stats':
+            record: Dict = {
+                'stats': item,
+                'target_address': address,
+                'educational_note': EDUCATIONAL_NOTE,
+                'done': True
+            }
+        else:
+            record = {kind: item}
+        
+        yield orjson.dumps(record) + b"\n"
+
+
+async def trace_stream(request: Request):
+    """
+    Example: /api/trace_stream?address=1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa&depth=5
+    
+    Accepts the same 'address', 'depth' and 'stop_on_coinbase' parameters
+    as /api/trace.
+    """
+    address = request.query_params.get('address')
+    stop_on_coinbase = request.query_params.get('stop_on_coinbase', '0') == '1'
+    
+    if not address:
+        return JSONResponse({
+            'error': 'Missing required parameter: address',
+            'usage': '/api/trace_stream?address=<bitcoin_address>&depth=<optional_depth>'
+        }, status_code=400, headers={'Cache-Control': 'no-store'})
+    
+    try:
+        depth = int(request.query_params.get('depth', 5))
+    except ValueError:
+        return JSONResponse(
+            {'error': 'depth must be an integer'},
+            status_code=400,
+            headers={'Cache-Control': 'no-store'}
+        )
+    
+    # Validate depth
+    if depth < 1 or depth > 10:
+        depth = 5
+    
+    return StreamingResponse(
+        iter_records(address, depth, stop_on_coinbase),
+        media_type='application/x-ndjson',
+        headers={'Cache-Control': 'no-store'}
+    )
+
+
+# Vercel serves the ASGI 'app'; match any path since the route is the file
+app = Starlette(routes=[Route('/{path:path}', trace_stream, methods=['GET'])])